@@ -1,13 +1,24 @@
 import time
-import copy
 import queue
-import json
+import re
+import ast
+import httpx
+import orjson
+import asyncio
+import threading
+import hashlib
+import functools
 import openai
-from typing import List, Dict
+import tenacity
+from collections import OrderedDict
+from openai import AsyncOpenAI
+from json_repair import loads as repair_loads
+from typing import List, Dict, Optional, Tuple, Union
 
 from multiprocessing import Queue
 
 from utils.utils import cprint
+from config import LLMConfig
 from message import Message, MessageType, Suggestion
 
 resp_format = {
@@ -21,6 +32,42 @@ resp_format = {
     "reason": "< Reason for the anomaly score >",
 }
 
+batch_resp_format = {
+    "results": [
+        {
+            "task_id": "< Id of the task these suggestions belong to >",
+            **resp_format
+        },
+    ],
+}
+
+# Rendered once, the formats are part of every prompt
+_RESP_FORMAT_STR = orjson.dumps(resp_format, option=orjson.OPT_INDENT_2).decode()
+_BATCH_RESP_FORMAT_STR = orjson.dumps(batch_resp_format, option=orjson.OPT_INDENT_2).decode()
+
+# Format instructions appended to every evolution update prompt
+_RESP_FORMAT_SUFFIX = f"\n\nPlease provide your suggestions in the following JSON format (give json data directly, don't wrap in code blocks):\n{_RESP_FORMAT_STR}"
+_BATCH_RESP_FORMAT_SUFFIX = f"\n\nPlease provide your suggestions for every task in the following JSON format, with one result per task_id (give json data directly, don't wrap in code blocks):\n{_BATCH_RESP_FORMAT_STR}"
+
+# Markdown code fences models wrap JSON in despite being told not to
+_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$", re.M)
+
+# Transport errors retried with backoff, the prompt itself is fine so no error feedback is sent.
+# Errors while reading a stream are raw httpx errors, not wrapped by the client
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+    httpx.TransportError,
+)
+_BACKOFF = tenacity.wait_exponential_jitter(initial=0.5, max=30)
+# Longest wait accepted from a Retry-After header, in seconds
+_MAX_RETRY_AFTER = 60.0
+
+# System prompts by (labels, operators, format), reused across INIT messages of the same task
+_SYSTEM_PROMPT_CACHE: Dict[Tuple, str] = {}
+
 class PromptTemplates:
     """Prompt Templates"""
     
@@ -78,6 +125,12 @@ Based on the above information, especially the effects of previous suggestions,
 3. Incorporate characteristics of excellent individuals in the current population
 4. Provide maximum of 3 expressions in suggestions
 5. Keep expressions concise, avoid overly complex expressions, minimize operators and variable symbols.
+"""
+
+    BATCH = """
+The following {num_tasks} tasks come from independent evolution updates. Please handle each task separately, as if it were its own round of interaction.
+
+{tasks}
 """
 
     ERROR_FEEDBACK = """
@@ -98,85 +151,417 @@ Please regenerate your suggestions, ensuring:
     @staticmethod
     def format_top_individuals(individuals: List[Dict]) -> str:
         """Format top individuals information"""
+        # Fields are coerced so the cache key is always hashable
+        return PromptTemplates._format_top_individuals(
+            tuple((str(ind['expression']), ind['fitness']) for ind in individuals)
+        )
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def _format_top_individuals(individuals: Tuple[Tuple[str, float], ...]) -> str:
+        """Format top individuals, cached since top individuals often repeat between rounds"""
         return "\n".join(
             f"Individual {i+1}:\n"
-            f"- Expression: {ind['expression']}\n"
-            f"- Fitness: {ind['fitness']:.4f}"
-            for i, ind in enumerate(individuals)
+            f"- Expression: {expression}\n"
+            f"- Fitness: {fitness:.4f}"
+            for i, (expression, fitness) in enumerate(individuals)
         )
 
     @staticmethod
     def format_previous_results(suggestions: Dict) -> str:
         """Format results from previous round suggestions"""
+        # Expression and reason come from the LLM and may be of any type,
+        # coerced so the cache key is always hashable
+        return PromptTemplates._format_previous_results(tuple(
+            (sugg['status'] == 'success', str(sugg['expression']),
+             sugg['fitness'] if sugg['status'] == 'success' else str(sugg['error']), str(sugg['reason']))
+            for sugg in suggestions['suggestions']
+        ))
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def _format_previous_results(suggestions: Tuple[Tuple[bool, str, Union[float, str], str], ...]) -> str:
+        """Format previous results, cached since results often repeat between rounds"""
         result = []
-        for sugg in suggestions['suggestions']:
-            if sugg['status'] == 'success':
+        for success, expression, outcome, reason in suggestions:
+            if success:
                 result.append(
-                    f"Suggested Expression: {sugg['expression']}\n"
-                    f"- Actual Fitness: {sugg['fitness']:.4f}\n"
-                    f"- Improvement Reason: {sugg['reason']}"
+                    f"Suggested Expression: {expression}\n"
+                    f"- Actual Fitness: {outcome:.4f}\n"
+                    f"- Improvement Reason: {reason}"
                 )
             else:
                 result.append(
-                    f"Suggested Expression: {sugg['expression']}\n"
-                    f"- Evaluation Failed: {sugg['error']}\n"
-                    f"- Improvement Reason: {sugg['reason']}"
+                    f"Suggested Expression: {expression}\n"
+                    f"- Evaluation Failed: {outcome}\n"
+                    f"- Improvement Reason: {reason}"
                 )
         return "\n\n".join(result)
 
+    @staticmethod
+    def create_evolution_prompt(top_individuals: List[Dict], previous_suggestions: Optional[Dict]) -> str:
+        """Create prompt for an evolution update"""
+        # Format top individuals information
+        formatted_individuals = PromptTemplates.format_top_individuals(top_individuals)
+        
+        # Choose template based on whether there are previous suggestions
+        if previous_suggestions is None:
+            return PromptTemplates.FIRST_ROUND.format(
+                top_individuals=formatted_individuals
+            )
+        formatted_results = PromptTemplates.format_previous_results(previous_suggestions)
+        return PromptTemplates.SUBSEQUENT_ROUND.format(
+            top_individuals=formatted_individuals,
+            previous_results=formatted_results
+        )
+
+    @staticmethod
+    def create_batch_prompt(prompts: List[str]) -> str:
+        """Combine several evolution prompts into one prompt with labeled tasks"""
+        tasks = "\n\n".join(
+            f"### Task {task_id}\n{prompt}"
+            for task_id, prompt in enumerate(prompts, start=1)
+        )
+        return PromptTemplates.BATCH.format(num_tasks=len(prompts), tasks=tasks)
+
     @staticmethod
     def create_system_prompt(labels: List[str], operators: List[str], format_example: Dict) -> str:
         """Create system prompt"""
-        return PromptTemplates.SYSTEM.format(
-            labels=labels,
-            operators=operators,
-            format=format_example
+        key = (tuple(labels), tuple(operators), format_example)
+        if key not in _SYSTEM_PROMPT_CACHE:
+            _SYSTEM_PROMPT_CACHE[key] = PromptTemplates.SYSTEM.format(
+                labels=labels,
+                operators=operators,
+                format=format_example
+            )
+        return _SYSTEM_PROMPT_CACHE[key]
+
+class ResponseCache:
+    """
+    LRU cache of validated LLM responses keyed by the whole request context
+    
+    Entries are only valid within one threshold experiment and are dropped with clear().
+    """
+    
+    def __init__(self, max_size: int = 128):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+    
+    @staticmethod
+    def make_key(messages: Tuple[Dict, ...]) -> str:
+        """Compute a canonical hash of dialog messages"""
+        return hashlib.blake2b(orjson.dumps(messages, option=orjson.OPT_SORT_KEYS)).hexdigest()
+    
+    def get(self, key: str) -> Optional[Tuple[str, List[Dict]]]:
+        """Get cached (model response, task payloads), or None on miss"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+    
+    def put(self, key: str, model_response: str, task_payloads: List[Dict]) -> None:
+        """Store a validated response, evicting the least recently used entries"""
+        if self.max_size <= 0:
+            return
+        self._entries[key] = (model_response, task_payloads)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+    
+    def clear(self) -> None:
+        """Drop all entries"""
+        self._entries.clear()
+
+def parse_model_response(model_response: str) -> Tuple[Dict, bool]:
+    """
+    Parse model response into a JSON object, repairing common formatting mistakes in-process
+    
+    Returns:
+        (payload, repaired), repaired is True if the response only parsed after repair
+    """
+    text = _FENCE_RE.sub("", model_response).strip()
+    repaired = False
+    try:
+        # Try to parse JSON directly
+        payload = orjson.loads(text)
+    except orjson.JSONDecodeError:
+        repaired = True
+        # Repair trailing commas, unquoted keys, truncated output, etc.
+        payload = repair_loads(text)
+        if not isinstance(payload, dict):
+            # Last resort, Python literal with single quotes
+            try:
+                payload = ast.literal_eval(text)
+            except (ValueError, SyntaxError) as e:
+                raise ValueError(f"Cannot parse response format: {e}")
+    
+    if not isinstance(payload, dict):
+        raise ValueError("Response is not a JSON object")
+    return payload, repaired
+
+def is_complete_json(text: str) -> bool:
+    """Check whether streamed text already holds a complete JSON object"""
+    try:
+        return isinstance(orjson.loads(_FENCE_RE.sub("", text).strip()), dict)
+    except orjson.JSONDecodeError:
+        return False
+
+async def stream_completion(llm_client: AsyncOpenAI, model_name: str, dialogs: List[Dict]) -> str:
+    """Stream a chat completion, stopping the generation once a complete JSON object has arrived"""
+    stream = await llm_client.chat.completions.create(
+        model=model_name,
+        messages=dialogs,
+        stream=True
+    )
+    chunks = []
+    # Brace depth of the streamed text, parsing is only attempted when it is balanced
+    depth = 0
+    opened = False
+    try:
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if not delta:
+                continue
+            chunks.append(delta)
+            depth += delta.count("{") - delta.count("}")
+            opened = opened or "{" in delta
+            if opened and depth == 0 and is_complete_json("".join(chunks)):
+                break
+    except openai.APIError as e:
+        if isinstance(e, RETRYABLE_ERRORS):
+            raise
+        # Error event sent by the server in the middle of the stream
+        raise openai.APIConnectionError(
+            message=f"Stream interrupted: {e.message}", request=e.request
+        ) from e
+    finally:
+        # Frees the model server from generating anything after the JSON
+        await stream.close()
+    return "".join(chunks).strip()
+
+def wait_retry_after(retry_state: tenacity.RetryCallState) -> float:
+    """
+    Wait as long as the server asks for in Retry-After (at most _MAX_RETRY_AFTER seconds),
+    otherwise back off exponentially with jitter
+    """
+    response = getattr(retry_state.outcome.exception(), "response", None)
+    headers = response.headers if response is not None else {}
+    try:
+        if "retry-after-ms" in headers:
+            return min(max(float(headers["retry-after-ms"]) / 1000, 0.0), _MAX_RETRY_AFTER)
+        if "retry-after" in headers:
+            return min(max(float(headers["retry-after"]), 0.0), _MAX_RETRY_AFTER)
+    except ValueError:
+        # HTTP date instead of seconds
+        pass
+    return _BACKOFF(retry_state)
+
+def log_retry(retry_state: tenacity.RetryCallState) -> None:
+    """Log a transport error before backing off"""
+    cprint(
+        f"LLM request failed (Attempt {retry_state.attempt_number}): {retry_state.outcome.exception()}, "
+        f"retrying in {retry_state.next_action.sleep:.1f}s",
+        'y'
+    )
+
+async def request_completion(
+    llm_client: AsyncOpenAI,
+    model_name: str,
+    dialogs: List[Dict],
+    semaphore: asyncio.Semaphore,
+    max_retries: int = 3
+) -> str:
+    """Request a completion, retrying transport errors with exponential backoff and jitter"""
+    async for attempt in tenacity.AsyncRetrying(
+        wait=wait_retry_after,
+        retry=tenacity.retry_if_exception_type(RETRYABLE_ERRORS),
+        stop=tenacity.stop_after_attempt(max_retries),
+        before_sleep=log_retry,
+        reraise=True
+    ):
+        with attempt:
+            # The semaphore is released while backing off
+            async with semaphore:
+                return await stream_completion(llm_client, model_name, dialogs)
+
+def send_error(queue_snd: Queue, error: str, retries: int, task_ids: Optional[List[int]] = None) -> None:
+    """Send error message, once per task since every task of a batch waits for an answer"""
+    error_msg = Message(
+        msg_type=MessageType.ERROR,
+        payload={
+            "error": error,
+            "retries": retries
+        }
+    )
+    for _ in task_ids or [None]:
+        queue_snd.put(error_msg.serialize())
+
+def validate_suggestion_payload(suggestion_payload: Dict) -> None:
+    """Validate the suggestions of a single task"""
+    if 'suggestions' not in suggestion_payload:
+        raise ValueError("Response missing 'suggestions' field")
+    # Also catches truncated output that repair turned into an empty list
+    if not isinstance(suggestion_payload['suggestions'], list) or not suggestion_payload['suggestions']:
+        raise ValueError("Response 'suggestions' must be a non-empty list")
+    
+    for suggestion in suggestion_payload['suggestions']:
+        if 'expression' not in suggestion or 'reason' not in suggestion:
+            raise ValueError("Suggestion missing required fields 'expression' or 'reason'")
+
+def split_batch_payload(batch_payload: Dict, task_ids: List[int]) -> List[Dict]:
+    """Split a batched response into one payload per task, ordered like task_ids"""
+    if 'results' not in batch_payload:
+        raise ValueError("Response missing 'results' field")
+    
+    results = {str(result.get('task_id')): result for result in batch_payload['results']}
+    missing = [task_id for task_id in task_ids if str(task_id) not in results]
+    if missing:
+        raise ValueError(f"Response missing results for tasks: {missing}")
+    return [results[str(task_id)] for task_id in task_ids]
+
+def send_suggestions(queue_snd: Queue, task_payloads: List[Dict]) -> None:
+    """Send one suggestion message per task payload"""
+    for task_payload in task_payloads:
+        suggestion_msg = Message(
+            msg_type=MessageType.SUGGESTION,
+            payload=task_payload
         )
+        queue_snd.put(suggestion_msg.serialize())
+
+class DialogWriter:
+    """File writer running in a background thread, so writing the conversation record never blocks the event loop"""
+    
+    def __init__(self, path: str, flush_every: int = 32):
+        self.flush_every = flush_every
+        self._records = queue.SimpleQueue()
+        self._file = open(path, "w")
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    
+    def write(self, text: str) -> None:
+        """Queue text to be written"""
+        self._records.put(text)
+    
+    def close(self) -> None:
+        """Write everything queued so far and close the file"""
+        self._records.put(None)
+        self._thread.join()
+    
+    def _run(self):
+        unflushed = 0
+        while True:
+            # Write all queued records in one call
+            batch = [self._records.get()]
+            while True:
+                try:
+                    batch.append(self._records.get_nowait())
+                except queue.Empty:
+                    break
+            closing = None in batch
+            if closing:
+                batch = batch[:batch.index(None)]
+            self._file.write("".join(batch))
+            unflushed += len(batch)
+            
+            if closing:
+                self._file.close()
+                return
+            # Flush every flush_every records, or as soon as the writer is idle
+            if unflushed >= self.flush_every or self._records.empty():
+                self._file.flush()
+                unflushed = 0
+
+def write_turn(out_f, turn: Dict) -> None:
+    """Append a dialog turn to the conversation record"""
+    out_f.write(f"{turn['role'].capitalize()}: {turn['content']}\n\n")
+    out_f.write("==================================\n")
+
+def trim_dialogs(dialogs: List[Dict], max_turns: int) -> None:
+    """
+    Keep the system message and only the latest max_turns turns (no limit if max_turns <= 0)
+    
+    Whole exchanges are dropped, so the kept turns always start with a user turn
+    as chat templates requiring user/assistant alternation expect.
+    """
+    if max_turns <= 0:
+        return
+    start = 1 if dialogs and dialogs[0]['role'] == 'system' else 0
+    excess = len(dialogs) - start - max_turns
+    if excess <= 0:
+        return
+    # Also drop the answers whose prompt falls out of the window
+    while start + excess < len(dialogs) and dialogs[start + excess]['role'] != 'user':
+        excess += 1
+    del dialogs[start:start + excess]
 
-def process_llm_response(llm_client, model_name, dialogs, queue_snd, max_retries=3):
-    """Process LLM response with retry mechanism"""
+async def process_llm_response(
+    llm_client: AsyncOpenAI,
+    model_name: str,
+    dialogs: List[Dict],
+    queue_snd: Queue,
+    max_retries: int = 3,
+    semaphore: Optional[asyncio.Semaphore] = None,
+    task_ids: Optional[List[int]] = None,
+    cache: Optional[ResponseCache] = None
+):
+    """
+    Process LLM response with retry mechanism
+    
+    Format errors are fed back to the model and retried right away, transport errors
+    (rate limits, timeouts, server errors) are retried with backoff and the prompt unchanged.
+    If task_ids is given, the last prompt is a batch of evolution updates and
+    one suggestion message is sent per task, in the order of task_ids.
+    If cache is given, a response to an identical request is reused without calling the LLM.
+    """
+    response_format = _RESP_FORMAT_STR if task_ids is None else _BATCH_RESP_FORMAT_STR
+    
+    # Reuse the response only if the model would see exactly the same conversation, a prompt
+    # repeated after earlier rounds is sent again so the model can resample its suggestions
+    cache_key = ResponseCache.make_key(tuple(dialogs)) if cache is not None else None
+    cached = cache.get(cache_key) if cache is not None else None
+    if cached is not None:
+        model_response, task_payloads = cached
+        dialogs.append({"role": "assistant", "content": model_response})
+        cprint(f"LLM Response (cached): {model_response}", 'c')
+        send_suggestions(queue_snd, task_payloads)
+        return True
+    
+    # Limit the number of concurrent in-flight requests
+    semaphore = semaphore or asyncio.Semaphore(1)
     retries = 0
     while retries < max_retries:
         try:
             # Call LLM
-            results = llm_client.chat.completions.create(
-                model=model_name,
-                messages=dialogs
+            model_response = await request_completion(
+                llm_client, model_name, dialogs, semaphore, max_retries
             )
-            model_response = results.choices[0].message.content.strip()
             
             # Record response
             dialogs.append({"role": "assistant", "content": model_response})
             cprint(f"LLM Response (Attempt {retries + 1}/{max_retries}): {model_response}", 'c')
             
-            try:
-                # Try to parse JSON directly
-                suggestion_payload = json.loads(model_response)
-            except json.JSONDecodeError:
-                # If failed, try replacing single quotes with double quotes and parse again
-                try:
-                    import ast
-                    suggestion_payload = ast.literal_eval(model_response)
-                except (ValueError, SyntaxError) as e:
-                    raise ValueError(f"Cannot parse response format: {e}")
+            suggestion_payload, repaired = parse_model_response(model_response)
             
             # Validate response format
-            if 'suggestions' not in suggestion_payload:
-                raise ValueError("Response missing 'suggestions' field")
-            
-            for suggestion in suggestion_payload['suggestions']:
-                if 'expression' not in suggestion or 'reason' not in suggestion:
-                    raise ValueError("Suggestion missing required fields 'expression' or 'reason'")
+            if task_ids is None:
+                task_payloads = [suggestion_payload]
+            else:
+                task_payloads = split_batch_payload(suggestion_payload, task_ids)
+            for task_payload in task_payloads:
+                validate_suggestion_payload(task_payload)
             
-            # Construct suggestion message and send
-            suggestion_msg = Message(
-                msg_type=MessageType.SUGGESTION,
-                payload=suggestion_payload
-            )
-            queue_snd.put(suggestion_msg.serialize())
+            # Construct suggestion messages and send
+            send_suggestions(queue_snd, task_payloads)
+            # Repaired responses may have lost content, the next identical prompt asks the model again
+            if cache is not None and not repaired:
+                cache.put(cache_key, model_response, task_payloads)
             return True
             
-        except (json.JSONDecodeError, ValueError) as e:
+        except RETRYABLE_ERRORS as e:
+            # Backoff retries are exhausted
+            send_error(queue_snd, f"LLM request failed: {str(e)}", max_retries, task_ids)
+            return False
+        except (orjson.JSONDecodeError, ValueError) as e:
             error_msg = f"Response format error: {str(e)}"
             retries += 1
         except Exception as e:
@@ -186,117 +571,192 @@ def process_llm_response(llm_client, model_name, dialogs, queue_snd, max_retries
         if retries < max_retries:
             # Add error feedback prompt
             error_prompt = PromptTemplates.ERROR_FEEDBACK.format(
-                format=json.dumps(resp_format, indent=2, ensure_ascii=False),
+                format=response_format,
                 error=error_msg
             )
             dialogs.append({"role": "user", "content": error_prompt})
             cprint(f"Sending error feedback: {error_prompt}", 'y')
         else:
             # Maximum retries reached, send error message
-            error_msg = Message(
-                msg_type=MessageType.ERROR,
-                payload={
-                    "error": error_msg,
-                    "retries": retries
-                }
-            )
-            queue_snd.put(error_msg.serialize())
+            send_error(queue_snd, error_msg, retries, task_ids)
             return False
 
-def llama_main(
+def queue_reader(queue_recv: Queue, aqueue: asyncio.Queue, loop: asyncio.AbstractEventLoop, batch_size: int = 1):
+    """Forward messages from the process queue into the event loop (runs in a daemon thread)"""
+    # faster_fifo queues hand over all pending messages in one call
+    # (a single one with GPRunner, which waits for each answer before sending more)
+    get_many = getattr(queue_recv, "get_many", None)
+    while True:
+        batch = get_many(max_messages_to_get=batch_size) if get_many else [queue_recv.get()]
+        try:
+            for data in batch:
+                loop.call_soon_threadsafe(aqueue.put_nowait, data)
+        except RuntimeError:
+            # Event loop is closed, conversation has ended
+            return
+
+async def llama_main(
     queue_recv: Queue,
     queue_snd: Queue,
-    llm_client: openai.OpenAI,
-    model_name: str = "Qwen/Qwen2.5-72B-Instruct"
+    llm_client: AsyncOpenAI,
+    model_name: str = "Qwen/Qwen2.5-72B-Instruct",
+    llm_config: Optional[LLMConfig] = None
 ):
-    out_f = open("output.txt", "w")
+    llm_config = llm_config or LLMConfig()
+    out_f = DialogWriter("output.txt")
     
     init_dialogs = []
     dialogs = []
+    dialog_lock = asyncio.Lock()
     
-    while True:
-        try:
-            data = queue_recv.get(timeout=1.0)  # Add timeout
-        except queue.Empty:
-            continue
+    loop = asyncio.get_running_loop()
+    aqueue = asyncio.Queue()
+    threading.Thread(
+        target=queue_reader, args=(queue_recv, aqueue, loop, llm_config.batch_size), daemon=True
+    ).start()
+    semaphore = asyncio.Semaphore(llm_config.max_concurrent_requests)
+    inflight = set()
+    response_cache = ResponseCache(llm_config.response_cache_size)
+    
+    async def converse(prompt: str, task_ids: Optional[List[int]], target: List[Dict], lock: asyncio.Lock) -> bool:
+        """Run one exchange on a dialog, after the previous exchanges on the same dialog have finished"""
+        # Requests of one dialog run one after another, so each sees the previous answer
+        # and the turns stay in user/assistant order
+        async with lock:
+            target.append({"role": "user", "content": prompt})
+            trim_dialogs(target, llm_config.context_window_turns)
+            start = len(target) - 1
+            try:
+                return await process_llm_response(
+                    llm_client, model_name, target, queue_snd,
+                    max_retries=llm_config.max_retries, semaphore=semaphore,
+                    task_ids=task_ids, cache=response_cache
+                )
+            finally:
+                # Write out the exchange and drop turns beyond the context window
+                for turn in target[start:]:
+                    write_turn(out_f, turn)
+                trim_dialogs(target, llm_config.context_window_turns)
+    
+    def dispatch(prompt: str, task_ids: Optional[List[int]] = None):
+        """Start an LLM request for the prompt without blocking the dispatcher"""
+        def on_done(task: asyncio.Task):
+            inflight.discard(task)
+            if task.cancelled():
+                return
+            if task.exception() is not None:
+                cprint(f"LLM request failed: {task.exception()}", 'r')
+            elif not task.result():
+                cprint("LLM response processing failed", 'r')
+                # Consider adding retry or recovery strategies
         
-        try:
-            msg = Message.deserialize(data)
-        except Exception as e:
-            cprint(f"Failed to deserialize message: {e}", "r")
-            continue
+        # Bound to the dialog of the current threshold experiment, requests of
+        # an earlier experiment keep running concurrently on their own dialog
+        task = asyncio.create_task(converse(prompt, task_ids, dialogs, dialog_lock))
+        task.add_done_callback(on_done)
+        inflight.add(task)
+    
+    def flush_updates(prompts: List[str]):
+        """Send pending evolution update prompts, batched into one request if several are queued"""
+        if not prompts:
+            return
+        if len(prompts) == 1:
+            prompt = prompts[0] + _RESP_FORMAT_SUFFIX
+            task_ids = None
+        else:
+            prompt = PromptTemplates.create_batch_prompt(prompts) + _BATCH_RESP_FORMAT_SUFFIX
+            task_ids = list(range(1, len(prompts) + 1))
+        prompts.clear()
         
-        if msg.msg_type == MessageType.INIT:
-            labels = msg.payload.get("labels", [])
-            operators = msg.payload.get("operators", [])
-            init_dialogs_setting = []
-            system_prompt = PromptTemplates.create_system_prompt(
-                labels=labels,
-                operators=operators,
-                format_example=json.dumps(resp_format, indent=2, ensure_ascii=False)
-            )
-            init_dialogs_setting.append({"role": "system", "content": system_prompt})
-            init_dialogs = init_dialogs_setting
-            cprint(f"System initialized: Computable variables: {labels}; Supported operators: {operators}", 'm')
-            cprint("LLM initialization complete, waiting for messages...", 'm')
-        elif msg.msg_type == MessageType.COMMAND:
-            command = msg.payload.get("command", "")
-            if command == "exit":
-                cprint("Received exit command, ending conversation.", 'r')
-                out_f.write("\n============Conversation ended.============\n")
-                out_f.flush()
+        cprint(f"Sending prompt to LLM: {prompt}\n", 'y')
+        
+        # Process LLM response (with retry mechanism) concurrently
+        dispatch(prompt, task_ids)
+    
+    exit_requested = False
+    while not exit_requested:
+        # In-flight requests keep running while waiting for the next message
+        batch = [await aqueue.get()]
+        
+        # Drain already queued messages so pending evolution updates share one request.
+        # GPRunner sends one update and waits for its answer, so with it a batch holds a single
+        # update; batching and concurrent requests only apply to producers that send several
+        # updates before reading the answers, e.g. parallel GP workers
+        while len(batch) < llm_config.batch_size:
+            try:
+                batch.append(aqueue.get_nowait())
+            except asyncio.QueueEmpty:
                 break
-            else:
-                cprint(f"Received unknown command: {command}", 'y')
-        elif msg.msg_type == MessageType.EVOLUTION_UPDATE:
-            top_individuals = msg.payload.get("top_individuals", [])
-            previous_suggestions = msg.payload.get("previous_suggestions", None)
+        
+        pending_prompts = []
+        for data in batch:
+            try:
+                msg = Message.deserialize(data)
+            except Exception as e:
+                cprint(f"Failed to deserialize message: {e}", "r")
+                continue
             
-            # Format top individuals information
-            formatted_individuals = PromptTemplates.format_top_individuals(top_individuals)
+            if msg.msg_type == MessageType.EVOLUTION_UPDATE:
+                pending_prompts.append(PromptTemplates.create_evolution_prompt(
+                    top_individuals=msg.payload.get("top_individuals", []),
+                    previous_suggestions=msg.payload.get("previous_suggestions", None)
+                ))
+                continue
             
-            # Choose template based on whether there are previous suggestions
-            if previous_suggestions is None:
-                prompt = PromptTemplates.FIRST_ROUND.format(
-                    top_individuals=formatted_individuals
+            # Keep message order: queued updates are sent before any other message is handled
+            flush_updates(pending_prompts)
+            
+            if msg.msg_type == MessageType.INIT:
+                labels = msg.payload.get("labels", [])
+                operators = msg.payload.get("operators", [])
+                init_dialogs_setting = []
+                system_prompt = PromptTemplates.create_system_prompt(
+                    labels=labels,
+                    operators=operators,
+                    format_example=_RESP_FORMAT_STR
                 )
+                init_dialogs_setting.append({"role": "system", "content": system_prompt})
+                init_dialogs = init_dialogs_setting
+                # Prompts of different tasks can be identical
+                response_cache.clear()
+                write_turn(out_f, init_dialogs[0])
+                cprint(f"System initialized: Computable variables: {labels}; Supported operators: {operators}", 'm')
+                cprint("LLM initialization complete, waiting for messages...", 'm')
+            elif msg.msg_type == MessageType.COMMAND:
+                command = msg.payload.get("command", "")
+                if command == "exit":
+                    cprint("Received exit command, ending conversation.", 'r')
+                    exit_requested = True
+                    break
+                else:
+                    cprint(f"Received unknown command: {command}", 'y')
+            elif msg.msg_type == MessageType.THRESHOLD_START:
+                threshold = msg.payload.get("threshold", None)
+                train_size = msg.payload.get("train_size", None)
+                test_size = msg.payload.get("test_size", None)
+                info = f"Received threshold experiment start message: Threshold = {threshold}, Training set size = {train_size}, Test set size = {test_size}"
+                cprint(info, 'm')
+                # Messages are only appended, never mutated, so a shallow copy is enough
+                dialogs = list(init_dialogs)
+                dialog_lock = asyncio.Lock()
+                # Same prompts mean different data under another threshold
+                response_cache.clear()
+                
+                out_f.write(info + "\n")
             else:
-                formatted_results = PromptTemplates.format_previous_results(previous_suggestions)
-                prompt = PromptTemplates.SUBSEQUENT_ROUND.format(
-                    top_individuals=formatted_individuals,
-                    previous_results=formatted_results
-                )
-            
-            prompt += f"\n\nPlease provide your suggestions in the following JSON format (give json data directly, don't wrap in code blocks):\n{json.dumps(resp_format, indent=2, ensure_ascii=False)}"
-            
-            dialogs.append({"role": "user", "content": prompt})
-            cprint(f"Sending prompt to LLM: {prompt}\n", 'y')
-            
-            # Process LLM response (with retry mechanism)
-            if not process_llm_response(llm_client, model_name, dialogs, queue_snd):
-                cprint("LLM response processing failed", 'r')
-                # Consider adding retry or recovery strategies
-        elif msg.msg_type == MessageType.THRESHOLD_START:
-            threshold = msg.payload.get("threshold", None)
-            train_size = msg.payload.get("train_size", None)
-            test_size = msg.payload.get("test_size", None)
-            info = f"Received threshold experiment start message: Threshold = {threshold}, Training set size = {train_size}, Test set size = {test_size}"
-            cprint(info, 'm')
-            dialogs = copy.deepcopy(init_dialogs)
-            
-            out_f.write(info + "\n")
-        else:
-            cprint(f"Received unknown message type: {msg.msg_type}", 'y')
-        out_f.flush()
-    
-    # Output conversation record
-    for msg in dialogs:
-        # print(f"{msg['role'].capitalize()}: {msg['content']}\n")
-        # print("==================================\n")
-        out_f.write(f"{msg['role'].capitalize()}: {msg['content']}\n\n")
-        out_f.write("==================================\n")
+                cprint(f"Received unknown message type: {msg.msg_type}", 'y')
+        
+        flush_updates(pending_prompts)
     
+    # Let pending requests deliver their suggestions first
+    if inflight:
+        await asyncio.wait(inflight)
+    out_f.write("\n============Conversation ended.============\n")
     out_f.close()
+
+def start_llama_main(*args, **kwargs):
+    """Process entry point running the LLM dialog loop in its own event loop"""
+    asyncio.run(llama_main(*args, **kwargs))
           
 def main():
     pass
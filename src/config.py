@@ -1,71 +1,131 @@
 """Configuration management for the SR system"""
 
 import os
+import sys
+import copy
 import yaml
+import functools
+import numpy as np
 from typing import Dict, Any, Optional, List
 from dataclasses import dataclass, field, fields
 from exceptions import ConfigError
+from utils.utils import cprint
 
-@dataclass
+# Slotted dataclasses need Python 3.10+
+_DATACLASS_OPTIONS = {'slots': True} if sys.version_info >= (3, 10) else {}
+
+# C-backed loader when PyYAML is built with libyaml
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+@functools.lru_cache(maxsize=8)
+def _load_yaml_cached(yaml_path: str, mtime: float) -> Any:
+    """Parse YAML file, cached by path and modification time"""
+    with open(yaml_path, 'r', encoding='utf-8') as f:
+        return yaml.load(f, Loader=_YAML_LOADER)
+
+def _check_constraints(config: Any) -> None:
+    """
+    Check the constraints declared in the field metadata of a configuration dataclass
+    
+    Supported metadata keys: 'gt' (lower bound, exclusive), 'between' (inclusive
+    (low, high) range) and 'non_empty'.
+    
+    Raises:
+        ConfigError: If a field violates its constraint
+    """
+    for f in fields(config):
+        if not f.metadata:
+            continue
+        value = getattr(config, f.name)
+        if 'gt' in f.metadata and not value > f.metadata['gt']:
+            raise ConfigError(f"{f.name} must be greater than {f.metadata['gt']}")
+        if 'between' in f.metadata:
+            low, high = f.metadata['between']
+            if not (low <= value <= high):
+                raise ConfigError(f"{f.name} must be between {low} and {high}")
+        if f.metadata.get('non_empty') and not value:
+            raise ConfigError(f"{f.name} cannot be empty")
+
+@dataclass(**_DATACLASS_OPTIONS)
 class TaskConfig:
     """Task configuration"""
     path: str = field(default_factory=str)
     prior_expressions: list = field(default_factory=list)
     thresholds: list = field(default_factory=list)
 
-@dataclass
+@dataclass(**_DATACLASS_OPTIONS)
 class TaskSettings:
     """Global task settings"""
     default_thresholds: List[float] = field(
-        default_factory=lambda: [i*0.02+0.01 for i in range(10)]
+        default_factory=lambda: (np.arange(10) * 0.02 + 0.01).tolist()
     )
     task_list: List[TaskConfig] = field(default_factory=list)
 
     @classmethod
     def from_dict(cls, config_dict: Dict[str, Any]) -> 'TaskSettings':
-        """Create TaskSettings instance from dictionary"""
+        """Create TaskSettings instance from dictionary, the dictionary is left unchanged"""
         # Get default thresholds
         default_thresholds = config_dict.get('default_thresholds')
+        if default_thresholds is None:
+            default_thresholds = cls().default_thresholds
         
         # Process task_list, use default_thresholds if thresholds is empty
-        task_list = []
-        for task in config_dict.get('task_list', []):
-            thresholds = task.get('thresholds', [])
-            if len(thresholds) == 0:  # Check if empty list
-                task['thresholds'] = default_thresholds
-            task_list.append(TaskConfig(**task))
+        task_list = [
+            TaskConfig(**{**task, 'thresholds': task.get('thresholds') or list(default_thresholds)})
+            for task in config_dict.get('task_list', [])
+        ]
 
         return cls(
             default_thresholds=default_thresholds,
             task_list=task_list
         )
 
-@dataclass
+@dataclass(**_DATACLASS_OPTIONS)
 class GPConfig:
-    """Genetic Programming configuration"""
-    num_generations: int = 500
-    population_size: int = 50
-    max_tree_height: int = 4
+    """
+    Genetic Programming configuration
+    
+    use_numba selects Numba-compiled fitness evaluation and numba_parallel compiles
+    it with parallel=True. Without numba installed, GPRunner falls back to Python evaluation.
+    """
+    num_generations: int = field(default=500, metadata={'gt': 0})
+    population_size: int = field(default=50, metadata={'gt': 0})
+    max_tree_height: int = field(default=4, metadata={'gt': 0})
     select_tour_size: int = 4
     hof_max_size: int = 10
-    crossover_prob: float = 0.5
-    mutation_prob: float = 0.3
+    crossover_prob: float = field(default=0.5, metadata={'between': (0, 1)})
+    mutation_prob: float = field(default=0.3, metadata={'between': (0, 1)})
     generation_step: int = 40
+    use_numba: bool = False
+    numba_parallel: bool = True
+
+    def __post_init__(self):
+        """Validate field constraints"""
+        _check_constraints(self)
 
-@dataclass
+@dataclass(**_DATACLASS_OPTIONS)
 class DataConfig:
     """Data processing configuration"""
     tt_ratio: float = 0.1
-    search_scale: int = 200
+    search_scale: int = field(default=200, metadata={'gt': 0})
     labels: list = field(default_factory=list)
     opt_expr_list: Optional[list] = None
+    expr_cache_size: int = 10000  # Compiled expressions kept by the evaluator
 
-@dataclass
+    def __post_init__(self):
+        """Validate field constraints"""
+        _check_constraints(self)
+
+@dataclass(**_DATACLASS_OPTIONS)
 class PathConfig:
     """Path configuration"""
-    output_base_dir: str = "output/"
+    output_base_dir: str = field(default="output/", metadata={'non_empty': True})
     _output_dir: str = "sr_generation_special/"
     _metric_save_path: str = "a_4metric_result/"
+    # Derived in __post_init__, declared so slotted instances can hold them
+    output_dir: str = field(init=False, metadata={'non_empty': True})
+    metric_save_path: str = field(init=False, metadata={'non_empty': True})
+    temp_dir: str = field(init=False)
     
     def __post_init__(self):
         """Process path combinations after initialization"""
@@ -74,17 +134,28 @@ class PathConfig:
         self.metric_save_path = os.path.join(self.output_base_dir, self._metric_save_path)
         # Create temporary file directory path
         self.temp_dir = os.path.join(self.output_base_dir, 'temp')
+        _check_constraints(self)
 
-@dataclass
+@dataclass(**_DATACLASS_OPTIONS)
 class LLMConfig:
     """LLM interaction configuration"""
     enable_llm: bool = True
     interaction_interval: int = 20  # Interaction interval generations
-    max_retries: int = 3
+    max_retries: int = field(default=3, metadata={'gt': 0})
     top_k_individuals: int = 5 
     response_timeout: float = 60.0  # seconds
+    max_concurrent_requests: int = field(default=4, metadata={'gt': 0})  # In-flight LLM requests
+    batch_size: int = field(default=8, metadata={'gt': 0})  # Evolution updates combined into one request
+    response_cache_size: int = 128  # Cached responses to identical requests
+    context_window_turns: int = 6  # Dialog turns sent besides the system prompt
+    max_connections: int = field(default=64, metadata={'gt': 0})  # Pooled HTTP connections to the LLM server
+    http2: bool = True  # Multiplex requests over HTTP/2 (requires h2)
 
-@dataclass
+    def __post_init__(self):
+        """Validate field constraints"""
+        _check_constraints(self)
+
+@dataclass(**_DATACLASS_OPTIONS)
 class SRConfig:
     """Main configuration class"""
     gp: GPConfig = field(default_factory=GPConfig)
@@ -136,30 +207,17 @@ class SRConfig:
             if not os.path.exists(yaml_path):
                 raise ConfigError(f"Configuration file does not exist: {yaml_path}")
                 
-            # Read YAML file
-            with open(yaml_path, 'r', encoding='utf-8') as f:
-                config_dict = yaml.safe_load(f)
+            # Read YAML file, copied since the parsed dict is shared by later loads
+            config_dict = copy.deepcopy(
+                _load_yaml_cached(yaml_path, os.path.getmtime(yaml_path))
+            )
                 
             # Validate configuration dictionary
             if not isinstance(config_dict, dict):
                 raise ConfigError("Invalid configuration file format: should be YAML dictionary")
                 
-            # Create sub-configuration objects
-            gp_config = GPConfig(**config_dict.get('gp', {}))
-            data_config = DataConfig(**config_dict.get('data', {}))
-            path_config = PathConfig(**config_dict.get('paths', {}))
-            task_settings = TaskSettings.from_dict(config_dict.get('tasks', {}))
-            
-            # Create main configuration object
-            config = cls(
-                gp=gp_config,
-                data=data_config,
-                paths=path_config,
-                task_settings=task_settings,
-                is_rearrange_result=config_dict.get('is_rearrange_result', False),
-                debug=config_dict.get('debug', False),
-                llm=LLMConfig(**config_dict.get('llm', {}))
-            )
+            # Create configuration object
+            config = cls.from_dict(config_dict)
             
             # Validate configuration
             config.validate()
@@ -178,29 +236,10 @@ class SRConfig:
         Raises:
             ConfigError: If configuration is invalid
         """
-        # Validate GP configuration
-        if self.gp.num_generations <= 0:
-            raise ConfigError("num_generations must be greater than 0")
-        if self.gp.population_size <= 0:
-            raise ConfigError("population_size must be greater than 0")
-        if self.gp.max_tree_height <= 0:
-            raise ConfigError("max_tree_height must be greater than 0")
-        if not (0 <= self.gp.crossover_prob <= 1):
-            raise ConfigError("crossover_prob must be between 0 and 1")
-        if not (0 <= self.gp.mutation_prob <= 1):
-            raise ConfigError("mutation_prob must be between 0 and 1")
-            
-        # Validate data configuration
-        if self.data.search_scale <= 0:
-            raise ConfigError("search_scale must be greater than 0")
-            
-        # Validate path configuration
-        if not self.paths.output_base_dir:
-            raise ConfigError("output_base_dir cannot be empty")
-        if not self.paths.output_dir:
-            raise ConfigError("output_dir cannot be empty")
-        if not self.paths.metric_save_path:
-            raise ConfigError("metric_save_path cannot be empty")
+        # Constraints are declared in field metadata and also checked on construction,
+        # checked again here since update() may have changed fields since
+        for sub_config in (self.gp, self.data, self.paths, self.llm):
+            _check_constraints(sub_config)
 
     def update(self, **kwargs):
         """
@@ -211,6 +250,7 @@ class SRConfig:
         data_fields = set(f.name for f in fields(DataConfig))
         gp_fields = set(f.name for f in fields(GPConfig))
         paths_fields = set(f.name for f in fields(PathConfig))
+        paths_init_fields = set(f.name for f in fields(PathConfig) if f.init)
         
         for key, value in kwargs.items():
             if key in data_fields:
@@ -219,6 +259,9 @@ class SRConfig:
                 setattr(self.gp, key, value)
             elif key in paths_fields:
                 setattr(self.paths, key, value)
+                # Recombine the derived paths from the updated components
+                if key in paths_init_fields:
+                    self.paths.__post_init__()
             elif hasattr(self, key):
                 setattr(self, key, value)
             else:
@@ -227,17 +270,17 @@ class SRConfig:
     @property
     def output_dir(self) -> str:
         """Get full output directory path"""
-        return os.path.join(self.paths.output_base_dir, self.paths._output_dir)
+        return self.paths.output_dir
 
     @property
     def metric_save_path(self) -> str:
         """Get full metric save path"""
-        return os.path.join(self.paths.output_base_dir, self.paths._metric_save_path)
+        return self.paths.metric_save_path
 
     @property
     def temp_dir(self) -> str:
         """Get temporary directory path"""
-        return os.path.join(self.paths.output_base_dir, 'temp')
+        return self.paths.temp_dir
 
     def ensure_directories(self) -> None:
         """Ensure all required directories exist"""
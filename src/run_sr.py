@@ -12,14 +12,16 @@ import time
 import json
 import math
 import shutil
+import httpx
 import openai
+import importlib.util
 import fire
 import functools
 import traceback
 from datetime import datetime
 from collections import Counter
 from multiprocessing import Process, Queue
-from typing import Dict, List, Any, Optional, Tuple
+from typing import Callable, Dict, List, Any, Optional, Tuple
 
 import numpy as np
 import matplotlib.pyplot as plt
@@ -30,8 +32,13 @@ from deap import base, creator, gp, tools, algorithms
 
 from sklearn.metrics import roc_auc_score, f1_score
 
+try:
+    import faster_fifo
+except ImportError:  # Not available on Windows
+    faster_fifo = None
+
 from utils.utils import cprint
-from chat_llm import llama_main
+from chat_llm import start_llama_main
 from config import SRConfig
 from exceptions import (
     SRException,
@@ -108,6 +115,49 @@ class GPOperators:
             'eq': operator.eq
         }
 
+    # Scalar versions of the operators for compiled kernels, booleans are returned as 1.0/0.0
+    @staticmethod
+    def s_and(a, b):
+        """Scalar logical AND operator"""
+        return 1.0 if (a >= 1 and b >= 1) else 0.0
+
+    @staticmethod
+    def s_or(a, b):
+        """Scalar logical OR operator"""
+        return 1.0 if (a >= 1 or b >= 1) else 0.0
+
+    @staticmethod
+    def s_not(a):
+        """Scalar logical NOT operator"""
+        return 1.0 if a >= 1 else 0.0
+
+    @staticmethod
+    def s_gt(a, b):
+        """Scalar greater than operator"""
+        return 1.0 if a > b else 0.0
+
+    @staticmethod
+    def s_lt(a, b):
+        """Scalar less than operator"""
+        return 1.0 if a < b else 0.0
+
+    @staticmethod
+    def s_eq(a, b):
+        """Scalar equality operator"""
+        return 1.0 if a == b else 0.0
+
+    @staticmethod
+    def get_scalar_operators():
+        """Get scalar operators, keyed like get_all_operators"""
+        return {
+            'and_': GPOperators.s_and,
+            'or_': GPOperators.s_or,
+            'not_': GPOperators.s_not,
+            'gt': GPOperators.s_gt,
+            'lt': GPOperators.s_lt,
+            'eq': GPOperators.s_eq
+        }
+
 class ExpressionToTreeConverter:
     """Class for converting natural language expressions to DEAP primitive trees"""
     
@@ -480,6 +530,16 @@ class ExpressionEvaluator:
             print(f"Error evaluating performance: {e}")
             return -np.inf
 
+    @staticmethod
+    def evaluate_kernel_performance(kernel, X, y, constants):
+        """Evaluate compiled expression kernel on all samples at once using AUROC score"""
+        try:
+            y_pred = kernel(X, constants).astype(int)
+            return roc_auc_score(y, y_pred)
+        except Exception as e:
+            print(f"Error evaluating performance: {e}")
+            return -np.inf
+
     @staticmethod
     def evaluate_loss(individual, X, y, compile_func, alpha=0.01):
         """Evaluate expression loss using BCE and complexity penalty"""
@@ -515,6 +575,84 @@ class ExpressionEvaluator:
                 flat_expr.append(item)
         return flat_expr
 
+class NumbaExpressionCompiler:
+    """
+    Class for compiling expressions into Numba kernels over sample batches
+    
+    Constants are passed to the kernel as an array, so individuals differing only in
+    their constants (e.g. ephemeral constants) share one compiled kernel.
+    """
+    
+    KERNEL_TEMPLATE = """
+def _kernel(_X, _c):
+    _n = _X.shape[0]
+    _out = _np.empty(_n, dtype=_np.bool_)
+    for _i in {loop}(_n):
+{assignments}
+        _out[_i] = ({expression}) != 0
+    return _out
+"""
+    # Kernels take a C-contiguous float64 sample matrix and the constants of the expression,
+    # and return one prediction per sample
+    KERNEL_SIGNATURE = "boolean[:](float64[:, ::1], float64[::1])"
+    
+    def __init__(self, arg_names: List[str], parallel: bool = True, cache_size: int = 10000):
+        """Initialize compiler, raises ImportError if numba is not installed"""
+        import numba
+        self.numba = numba
+        self.arg_names = list(arg_names)
+        self.parallel = parallel
+        # Operators are compiled once and cached on disk, kernels call them by name
+        self.namespace = {
+            name: numba.njit(cache=True)(op)
+            for name, op in GPOperators.get_scalar_operators().items()
+        }
+        self.namespace.update({'_np': np, '_prange': numba.prange})
+        self.compile = functools.lru_cache(maxsize=cache_size)(self._compile_expr)
+    
+    @staticmethod
+    def split_constants(individual: gp.PrimitiveTree) -> Tuple[str, np.ndarray]:
+        """Render the individual with its numeric constants replaced by _c[k], returns (shape, constants)"""
+        constants = []
+        stack = []
+        for node in individual:
+            if isinstance(node, gp.Terminal) and isinstance(node.value, (int, float)) and not isinstance(node.value, bool):
+                stack.append((f"_c[{len(constants)}]", None))
+                constants.append(float(node.value))
+            else:
+                stack.append((node, []))
+            # Format every node whose arguments are complete, as PrimitiveTree.__str__ does
+            while stack[-1][1] is None or len(stack[-1][1]) == stack[-1][0].arity:
+                node_str, args = stack.pop()
+                if args is not None:
+                    node_str = node_str.format(*args)
+                if not stack:
+                    return node_str, np.array(constants, dtype=np.float64)
+                stack[-1][1].append(node_str)
+        raise ValueError(f"Incomplete expression tree: {individual}")
+    
+    def generate_source(self, expr_str: str) -> str:
+        """Generate kernel source evaluating the expression for every sample"""
+        assignments = "\n".join(
+            f"        {name} = _X[_i, {idx}]" for idx, name in enumerate(self.arg_names)
+        )
+        return self.KERNEL_TEMPLATE.format(
+            loop='_prange' if self.parallel else 'range',
+            assignments=assignments or "        pass",
+            expression=expr_str
+        )
+    
+    def _compile_expr(self, expr_str: str) -> Optional[Callable]:
+        """Compile expression shape into a kernel, None if numba cannot compile it"""
+        try:
+            namespace = dict(self.namespace)
+            exec(self.generate_source(expr_str), namespace)
+            # Generated functions have no source file, so kernels are only cached in memory
+            return self.numba.njit(self.KERNEL_SIGNATURE, parallel=self.parallel)(namespace['_kernel'])
+        except Exception as e:
+            cprint(f"Numba compilation failed for {expr_str}: {e}", 'y')
+            return None
+
 class PrimitiveSetBuilder:
     """Class for building primitive sets for genetic programming"""
     
@@ -629,8 +767,23 @@ class GPRunner:
         self.hof = None
         self.population = None  # Add population attribute
         self.llm_suggestions_history = []
+        self.expr_compiler = self._create_expr_compiler()
         self._setup_toolbox()
 
+    def _create_expr_compiler(self) -> Optional[NumbaExpressionCompiler]:
+        """Create Numba expression compiler if enabled and available"""
+        if not self.config.gp.use_numba:
+            return None
+        try:
+            return NumbaExpressionCompiler(
+                self.pset.arguments,
+                parallel=self.config.gp.numba_parallel,
+                cache_size=self.config.data.expr_cache_size
+            )
+        except ImportError:
+            cprint("numba is not installed, using Python fitness evaluation", 'y')
+            return None
+
     def _setup_toolbox(self):
         """Setup DEAP toolbox with genetic operators"""
         creator.create("FitnessMax", base.Fitness, weights=(1.0,))
@@ -674,6 +827,17 @@ class GPRunner:
     def _evaluate_individual(self, individual):
         """Evaluate a single individual"""
         try:
+            kernel = None
+            if self.expr_compiler:
+                # Kernels are cached by expression shape, constants are passed at call time
+                shape, constants = self.expr_compiler.split_constants(individual)
+                kernel = self.expr_compiler.compile(shape)
+            if kernel is not None:
+                # Evaluate all samples with the compiled kernel
+                score = ExpressionEvaluator.evaluate_kernel_performance(
+                    kernel, self.X_array, self.y, constants
+                )
+                return (score,)
             # Compile expression
             func = gp.compile(individual, self.pset)
             # Evaluate performance
@@ -686,6 +850,7 @@ class GPRunner:
         """Run evolution process with LLM interaction"""
         self.X = X
         self.y = y
+        self.X_array = np.ascontiguousarray(X, dtype=np.float64)
         
         self.population = self.toolbox.population(n=self.config.gp.population_size)  # Use class attribute
         best_history = []
@@ -1359,17 +1524,43 @@ class Utils:
                 raise SRException(f"File operation failed: {str(e)}")
         return wrapper
 
+if faster_fifo is not None:
+    class FastQueue(faster_fifo.Queue):
+        """Shared-memory faster_fifo queue blocking without timeout by default, like multiprocessing.Queue"""
+        
+        BLOCK_FOREVER = float(1e9)  # seconds
+        
+        def put(self, x, block=True, timeout=None):
+            return super().put(x, block, self.BLOCK_FOREVER if timeout is None else timeout)
+        
+        def get(self, block=True, timeout=None):
+            return super().get(block, self.BLOCK_FOREVER if timeout is None else timeout)
+        
+        def get_many(self, block=True, timeout=None, max_messages_to_get=int(1e9)):
+            return super().get_many(
+                block, self.BLOCK_FOREVER if timeout is None else timeout, max_messages_to_get
+            )
+else:
+    FastQueue = None
+
 class ProcessManager:
     """Class for managing multiprocessing"""
     
     def __init__(self, queue_size=100):
-        self.question_queue = Queue(maxsize=queue_size)
-        self.answer_queue = Queue(maxsize=queue_size)
+        self.question_queue = self._create_queue(queue_size)
+        self.answer_queue = self._create_queue(queue_size)
         self.processes = []
     
-    def add_process(self, target, daemon=True, args=()):
+    @staticmethod
+    def _create_queue(queue_size):
+        """Create message queue, backed by a shared-memory ring buffer if faster_fifo is available"""
+        if FastQueue is None:
+            return Queue(maxsize=queue_size)
+        return FastQueue(maxsize=queue_size)
+    
+    def add_process(self, target, daemon=True, args=(), kwargs=None):
         """Add new process"""
-        process = Process(target=target, args=args, daemon=daemon)
+        process = Process(target=target, args=args, kwargs=kwargs or {}, daemon=daemon)
         self.processes.append(process)
     
     def start_all(self):
@@ -1498,7 +1689,7 @@ class MessageHandler:
             for s in response.payload['suggestions']
         ]
 
-def main(llm_client: openai.OpenAI = None, enable_llm: bool = True, config_path: str = "config/default_config.yaml"):
+def main(llm_client: openai.AsyncOpenAI = None, enable_llm: bool = True, config_path: str = "config/default_config.yaml"):
     """Main entry point with signal handling"""
     def signal_handler(sig, frame):
         print(f"\nCaught signal {sig}, performing cleanup...")
@@ -1532,12 +1723,13 @@ def main(llm_client: openai.OpenAI = None, enable_llm: bool = True, config_path:
             # Add LLM process
             if llm_client:
                 process_manager.add_process(
-                    llama_main,
+                    start_llama_main,
                     args=(
                         process_manager.question_queue, 
                         process_manager.answer_queue,
                         llm_client
-                    )
+                    ),
+                    kwargs={"llm_config": SRConfig.from_yaml(config_path).llm}
                 )
             
             # Add SR generation process
@@ -1573,12 +1765,32 @@ def main(llm_client: openai.OpenAI = None, enable_llm: bool = True, config_path:
         if log_manager:
             log_manager.close()
 
+def create_llm_client(config: SRConfig) -> openai.AsyncOpenAI:
+    """Create async LLM client sharing a pool of keep-alive (HTTP/2 if available) connections"""
+    http2 = config.llm.http2
+    if http2 and importlib.util.find_spec("h2") is None:
+        cprint("h2 is not installed, falling back to HTTP/1.1 for LLM requests", 'y')
+        http2 = False
+    
+    http_client = httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=config.llm.max_connections,
+            max_keepalive_connections=config.llm.max_connections // 2
+        ),
+        timeout=httpx.Timeout(config.llm.response_timeout)
+    )
+    # Transport errors are retried with backoff by the LLM process, not by the client
+    return openai.AsyncOpenAI(
+        base_url=LLM_SERVER_URL, api_key=API_KEY, http_client=http_client, max_retries=0
+    )
+
 def cli_main(enable_llm=True, config_path="config/default_config.yaml"):
     """Command line interface for SR generation"""
     if enable_llm and not API_KEY:
         raise ConfigError("SR_API_KEY environment variable required when LLM is enabled")
         
-    llm_client = openai.OpenAI(base_url=LLM_SERVER_URL, api_key=API_KEY) if enable_llm else None
+    llm_client = create_llm_client(SRConfig.from_yaml(config_path)) if enable_llm else None
     return main(llm_client=llm_client, enable_llm=enable_llm, config_path=config_path)
 
 if __name__ == '__main__':